@@ -1,9 +1,18 @@
 
 from __future__ import annotations
 
-from typing import Dict, Optional
+import asyncio
+import json
+import os
+import threading
+import uuid
+import weakref
+from typing import Dict, List, Optional, Tuple
 
+import ahocorasick
+from cachetools import LRUCache
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from ..rag.chains import build_chain
@@ -12,11 +21,17 @@ from ..rag.retriever import get_retriever
 # LangChain conversation history
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.messages import BaseMessage
 
 
 # ---------------- Router ----------------
 router = APIRouter(prefix="/api", tags=["chat"])
 
+# Cap in-flight RAG turns so a burst of requests doesn't exhaust the
+# PGVector connection pool or trip provider rate limits.
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "16"))
+_sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
 
 # ---------------- Models ----------------
 class Query(BaseModel):
@@ -45,20 +60,34 @@ ABUSIVE_WORDS = {
 }
 
 
+# One linear pass over the message regardless of vocabulary size.
+_abuse_ac = ahocorasick.Automaton()
+for _word in ABUSIVE_WORDS:
+    _abuse_ac.add_word(_word, _word)
+_abuse_ac.make_automaton()
+del _word
+
+
+ABUSE_MSG = (
+    "I’m here to help with MFI Business Document queries. "
+    "I can’t continue when there’s abusive language—please rephrase your question respectfully."
+)
+
+
 def contains_abuse(text: str) -> bool:
-    t = text.lower()
-    return any(bad in t for bad in ABUSIVE_WORDS)
+    return next(_abuse_ac.iter(text.lower()), None) is not None
 
 
 # ---------------- Simple retriever debug ----------------
 @router.post("/chat_debug")
-def chat_debug(q: Query):
+async def chat_debug(q: Query):
     """
     Returns the first ~300 chars of retrieved chunks for a given query.
     Useful to confirm embeddings + PGVector wiring.
     """
     try:
-        docs = get_retriever().invoke(q.message)  # list[Document]
+        async with _sem:
+            docs = await get_retriever().ainvoke(q.message)  # list[Document]
         return {"chunks": [d.page_content[:300] for d in docs]}
     except Exception as e:
         import traceback
@@ -67,42 +96,161 @@ def chat_debug(q: Query):
 
 
 # ---------------- Chat with memory + RAG ----------------
-_histories: Dict[str, InMemoryChatMessageHistory] = {}
+# Idle sessions are evicted LRU-first; each history keeps only the most recent
+# messages so memory and prompt size stay bounded on a long-lived server.
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+
+
+class _BoundedHistory(InMemoryChatMessageHistory):
+    """In-memory history trimmed to the last MAX_HISTORY_MESSAGES messages."""
+
+    def add_message(self, message: BaseMessage) -> None:
+        super().add_message(message)
+        if len(self.messages) > MAX_HISTORY_MESSAGES:
+            del self.messages[:-MAX_HISTORY_MESSAGES]
+
+
+_histories: LRUCache = LRUCache(maxsize=SESSION_CACHE_SIZE)
+_histories_lock = threading.Lock()
 
 
 def _get_history(session_id: str) -> InMemoryChatMessageHistory:
     """Return (or create) an in-memory history bucket per session id."""
-    return _histories.setdefault(
-        session_id or "default", InMemoryChatMessageHistory()
-    )
+    sid = session_id or "default"
+    with _histories_lock:
+        hist = _histories.get(sid)
+        if hist is None:
+            hist = _histories[sid] = _BoundedHistory()
+        return hist
+
+
+# Same-session turns must not interleave (history is read at the start of a
+# turn and appended at the end); different sessions proceed in parallel.
+# Entries vanish once no coroutine holds the lock.
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _lock_for(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = _session_locks[session_id] = asyncio.Lock()
+    return lock
 
 
 def _history_from_cfg(cfg) -> InMemoryChatMessageHistory:
     """
-    RunnableWithMessageHistory callback: pull session_id from config.
-    Expects config={"configurable":{"session_id": "xyz"}}
+    RunnableWithMessageHistory callback.
+    LangChain passes the configurable session_id value itself, but a full
+    config={"configurable":{"session_id": "xyz"}} is accepted too.
     """
     sid = "default"
-    if isinstance(cfg, dict):
+    if isinstance(cfg, str):
+        sid = cfg
+    elif isinstance(cfg, dict):
         sid = (cfg.get("configurable") or {}).get("session_id", "default")
     return _get_history(sid)
 
 
+def _provider_key(provider: Optional[str]) -> str:
+    """provider: 'gemini' (default) or 'fireworks'"""
+    return "fireworks" if (provider or "gemini").lower() == "fireworks" else "gemini"
+
+
 def _pick_llm(provider: Optional[str]):
     """
     Lazy-import the chosen LLM so dependencies are optional.
     provider: 'gemini' (default) or 'fireworks'
     """
-    prov = (provider or "gemini").lower()
-    if prov == "fireworks":
+    if _provider_key(provider) == "fireworks":
         from ..services.llm_fireworks import get_llm as _get
     else:
         from ..services.llm_gemini import get_llm as _get
     return _get()
 
 
+# One ready-built chain per provider; session state lives in _histories, so
+# the same chain object serves every request for that provider.
+_CHAINS: Dict[str, RunnableWithMessageHistory] = {}
+
+
+def get_chat_chain(provider: Optional[str]) -> RunnableWithMessageHistory:
+    """Return (building on first use) the history-aware RAG chain for a provider."""
+    key = _provider_key(provider)
+    chain = _CHAINS.get(key)
+    if chain is None:
+        rag = build_chain(_pick_llm(key), get_retriever())  # Runnable -> {"answer": str}
+        chain = _CHAINS.setdefault(
+            key,
+            RunnableWithMessageHistory(
+                rag,
+                _history_from_cfg,
+                input_messages_key="question",
+                history_messages_key="history",
+                output_messages_key="answer",
+            ),
+        )
+    return chain
+
+
+async def _run_turn(q: Query) -> dict:
+    """One RAG turn for a single Query -> {"answer": str}."""
+    # 1) Abuse guard (short-circuit before touching the LLM)
+    if contains_abuse(q.message):
+        return {"answer": ABUSE_MSG}
+
+    # 2) Prebuilt chain for the provider (LLM + retriever + message history)
+    chat_chain = get_chat_chain(q.provider)
+
+    # 3) Invoke with a stable session id (client decides; defaults to "default")
+    sid = q.session_id or "default"
+    cfg = {"configurable": {"session_id": sid}}
+    async with _lock_for(sid), _sem:
+        result = await chat_chain.ainvoke({"question": q.message}, config=cfg)
+
+    # 4) Normalize result
+    if isinstance(result, dict) and "answer" in result:
+        return {"answer": result["answer"]}
+    return {"answer": str(result)}
+
+
+# Single-flight: identical (session, message, provider) turns already in
+# flight are joined instead of re-running retrieval + LLM (UI double-posts).
+# Shared by /chat, /chat_batch and /chat_stream.
+_inflight: Dict[Tuple[str, str, str], asyncio.Future] = {}
+
+
+def _inflight_key(q: Query) -> Tuple[str, str, str]:
+    return (q.session_id or "default", q.message, _provider_key(q.provider))
+
+
+def _track_inflight(key: Tuple[str, str, str], fut: asyncio.Future) -> None:
+    _inflight[key] = fut
+
+    def _done(f: asyncio.Future) -> None:
+        if _inflight.get(key) is f:
+            del _inflight[key]
+        # Mark the exception retrieved: if every joined caller was cancelled,
+        # nobody else reads it and asyncio would log "exception was never retrieved".
+        if not f.cancelled():
+            f.exception()
+
+    fut.add_done_callback(_done)
+
+
+async def _answer(q: Query) -> dict:
+    """_run_turn(), coalesced with any identical turn already in flight."""
+    key = _inflight_key(q)
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(_run_turn(q))
+        _track_inflight(key, fut)
+    # shield: a caller that disconnects must not cancel the turn for the others
+    return await asyncio.shield(fut)
+
+
 @router.post("/chat")
-def chat(q: Query):
+async def chat(q: Query):
     """
     Main chat endpoint.
     - Abuse guard (short-circuits).
@@ -110,33 +258,87 @@ def chat(q: Query):
     - RAG chain with PGVector retriever.
     - Conversational memory via RunnableWithMessageHistory.
     """
-    # 1) Abuse guard (short-circuit before touching the LLM)
-    if contains_abuse(q.message):
-        return {
-            "answer": (
-                "I’m here to help with MFI Business Document queries. "
-                "I can’t continue when there’s abusive language—please rephrase your question respectfully."
-            )
-        }
-
-    # 2) Build LLM (based on provider) + retriever + chain
-    llm = _pick_llm(q.provider)
-    chain = build_chain(llm, get_retriever())  # returns Runnable -> {"answer": str}
-
-    # 3) Wrap with message history
-    chat_chain = RunnableWithMessageHistory(
-        chain,
-        _history_from_cfg,
-        input_messages_key="question",
-        history_messages_key="history",
-        output_messages_key="answer",
-    )
+    return await _answer(q)
 
-    # 4) Invoke with a stable session id (client decides; defaults to "default")
-    cfg = {"configurable": {"session_id": q.session_id or "default"}}
-    result = chat_chain.invoke({"question": q.message}, config=cfg)
 
-    # 5) Normalize result
-    if isinstance(result, dict) and "answer" in result:
-        return {"answer": result["answer"]}
-    return {"answer": str(result)}
+@router.post("/chat_batch")
+async def chat_batch(qs: List[Query]):
+    """
+    Answer several queries in one HTTP round-trip (bulk evaluation clients).
+    Items run concurrently, still bounded by MAX_CONCURRENCY; answers come
+    back in request order.
+    Items without a session_id are independent: each gets a throwaway session
+    (no shared history, no shared session lock) that is discarded afterwards.
+    Items sharing a session_id run in order within that session, as on /chat.
+    """
+    throwaway: List[str] = []
+    items: List[Query] = []
+    for q in qs:
+        if not q.session_id:
+            sid = f"batch-{uuid.uuid4().hex}"
+            throwaway.append(sid)
+            q = q.model_copy(update={"session_id": sid})
+        items.append(q)
+    try:
+        return {"answers": await asyncio.gather(*(_answer(q) for q in items))}
+    finally:
+        with _histories_lock:
+            for sid in throwaway:
+                _histories.pop(sid, None)
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def _stream_turn(q: Query, key: Tuple[str, str, str]):
+    """Stream one turn as SSE deltas; duplicates join it via _inflight."""
+    fut = asyncio.get_running_loop().create_future()
+    _track_inflight(key, fut)
+    sid = q.session_id or "default"
+    cfg = {"configurable": {"session_id": sid}}
+    parts: List[str] = []
+    try:
+        chat_chain = get_chat_chain(q.provider)
+        async with _lock_for(sid), _sem:
+            async for chunk in chat_chain.astream({"question": q.message}, config=cfg):
+                delta = chunk.get("answer") if isinstance(chunk, dict) else None
+                if delta:
+                    parts.append(delta)
+                    yield _sse({"delta": delta})
+    except BaseException as e:
+        # client disconnects surface as GeneratorExit/CancelledError
+        if not fut.done():
+            fut.set_exception(e if isinstance(e, Exception) else RuntimeError("stream was cancelled"))
+        raise
+    fut.set_result({"answer": "".join(parts)})
+
+
+@router.post("/chat_stream")
+async def chat_stream(q: Query):
+    """
+    Same as /chat, but streams the answer as Server-Sent Events:
+      data: {"delta": "..."}   (repeated)
+      data: [DONE]
+    """
+
+    async def _gen():
+        if contains_abuse(q.message):
+            yield _sse({"delta": ABUSE_MSG})
+            yield "data: [DONE]\n\n"
+            return
+        key = _inflight_key(q)
+        running = _inflight.get(key)
+        try:
+            if running is not None:
+                # Duplicate of a turn already in flight: send its full answer once
+                result = await asyncio.shield(running)
+                yield _sse({"delta": result["answer"]})
+            else:
+                async for event in _stream_turn(q, key):
+                    yield event
+        except Exception as e:
+            yield _sse({"error": str(e)})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(_gen(), media_type="text/event-stream")
@@ -3,12 +3,13 @@
 from __future__ import annotations
 
 import os
+import asyncio
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 # Routers
-from .api.routes_chat import router as chat_router
+from .api.routes_chat import router as chat_router, get_chat_chain
 
 # Warmup targets
 from .rag.retriever import get_retriever
@@ -77,9 +78,13 @@ def root():
     }
 
 
+# Set once background warmup (see _startup) has finished
+WARM_READY = asyncio.Event()
+
+
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "ready": WARM_READY.is_set()}
 
 
 # -----------------------------------------------------------------------------
@@ -87,46 +92,62 @@ def health():
 # -----------------------------------------------------------------------------
 def _warm_retriever():
     try:
-        get_retriever()  # builds vector store + loads embedding model
+        get_retriever().invoke("warmup")  # loads embedding model + opens PG pool
         logger.info("[warmup] retriever ready")
     except Exception as e:  # pragma: no cover
         logger.warning(f"[warmup] retriever error: {e}")
 
 
-def _warm_llms():
-    # Gemini
+def _warm_gemini():
     try:
         get_gemini_llm()
-        logger.info("[warmup] gemini llm ready")
+        get_chat_chain("gemini")
+        logger.info("[warmup] gemini llm + chain ready")
     except Exception as e:  # pragma: no cover
         logger.warning(f"[warmup] gemini error: {e}")
 
+
+def _warm_fireworks():
     # Fireworks (optional)
     if get_fireworks_llm:
         try:
             get_fireworks_llm()
-            logger.info("[warmup] fireworks llm ready")
+            get_chat_chain("fireworks")
+            logger.info("[warmup] fireworks llm + chain ready")
         except Exception as e:  # pragma: no cover
             logger.warning(f"[warmup] fireworks error: {e}")
     else:
         logger.info("[warmup] fireworks llm not configured; skipping")
 
 
+async def _warmup_all():
+    # Model download / PG connect / SDK init overlap instead of running back to back
+    await asyncio.gather(
+        asyncio.to_thread(_warm_retriever),
+        asyncio.to_thread(_warm_gemini),
+        asyncio.to_thread(_warm_fireworks),
+    )
+    WARM_READY.set()
+    logger.info("[startup] warmup complete")
+
+
+_warmup_task: asyncio.Task | None = None
+
+
 @app.on_event("startup")
-def _startup():
+async def _startup():
     """
-    Preload heavy components so the first user request doesn't hit long
-    model downloads or PG connections.
+    Preload heavy components in the background so the first user request
+    doesn't hit long model downloads or PG connections, while the server
+    starts accepting requests (and /health reports ready=false) immediately.
     """
-    logger.info("[startup] warming up backend components...")
-    _warm_retriever()
-    _warm_llms()
-    logger.info("[startup] warmup complete")
+    global _warmup_task
+    logger.info("[startup] warming up backend components in background...")
+    _warmup_task = asyncio.create_task(_warmup_all())  # keep a ref so it isn't GC'd
 
 
 # Optional manual warmup endpoint if you want to trigger it yourself
 @app.post("/warmup")
-def manual_warmup():
-    _warm_retriever()
-    _warm_llms()
+async def manual_warmup():
+    await _warmup_all()
     return {"status": "warmed"}
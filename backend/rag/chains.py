@@ -1,36 +1,48 @@
 
 from __future__ import annotations
 from typing import List
-from operator import itemgetter
 
 from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import (
-    RunnableLambda,
-    RunnableParallel,
-    RunnableBranch,
-)
+from langchain_core.runnables import AddableDict, RunnableLambda
 
 # ---- Single source of truth for refusal text
 SCOPE_MSG = "That topic is outside my scope. I can help with MFI Business Document related information."
 
 
+def _query_variants(d: dict) -> List[str]:
+    """
+    Raw question plus a history-condensed variant (previous user turn + question),
+    so follow-ups like "and what about its risks?" still find the right chunks.
+    The raw question stays first: the retriever decides scope from its hits alone.
+    """
+    question = d["question"]
+    last_user = next(
+        (m.content for m in reversed(d.get("history") or []) if m.type == "human"),
+        None,
+    )
+    if not isinstance(last_user, str) or not last_user.strip():
+        return [question]
+    return [question, f"{last_user}\n{question}"]
+
+
 # llm: any LangChain chat model
-# retriever: any LangChain retriever that supports .invoke(question) -> List[Document]
+# retriever: Runnable that supports .invoke(list[str] | str) -> List[Document]
 def build_chain(llm, retriever):
     """
     Returns a Runnable that:
       input:  {"question": str, "history": list[BaseMessage]}
       output: {"answer": str}
+
+    Retrieval, context building and the empty-context refusal run in one
+    function instead of a RunnableParallel/RunnableBranch graph, so each turn
+    costs a single dict pass on top of the LLM call.
     """
     # Prepare context from retrieved docs
     def _join_docs(docs: List[Document]) -> str:
         return "\n\n".join(d.page_content for d in docs)
 
-    # Build context from retrieval
-    context = itemgetter("question") | retriever | RunnableLambda(_join_docs)
-
     # Prompt with conversation history (tightened instructions)
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -51,23 +63,30 @@ def build_chain(llm, retriever):
         ]
     )
 
-    # Inputs fan-in
-    inputs = RunnableParallel(
-        question=itemgetter("question"),
-        history=itemgetter("history"),
-        context=context,
-    )
+    llm_chain = prompt | llm | StrOutputParser()
 
-    # Branch: if context is empty -> refuse with fixed message; else go to LLM chain
-    refuse_if_no_context = RunnableLambda(lambda d: {"answer": SCOPE_MSG})
+    def _prompt_inputs(d: dict, docs: List[Document]) -> dict:
+        return {
+            "question": d["question"],
+            "history": d.get("history") or [],
+            "context": _join_docs(docs),
+        }
 
-    llm_chain = prompt | llm | StrOutputParser() | RunnableLambda(lambda text: {"answer": text})
+    def _pipeline(d: dict) -> dict:
+        inputs = _prompt_inputs(d, retriever.invoke(_query_variants(d)))
+        # No/blank context → refuse deterministically
+        if not inputs["context"].strip():
+            return {"answer": SCOPE_MSG}
+        return {"answer": llm_chain.invoke(inputs)}
 
-    chain = inputs | RunnableBranch(
-        # Condition 1: no/blank context → refuse deterministically
-        (lambda d: not d.get("context", "").strip(), refuse_if_no_context),
-        # Fallback: normal flow
-        llm_chain,
-    )
+    # Async path yields {"answer": delta} chunks so astream() streams tokens;
+    # ainvoke() adds the AddableDict chunks back into the full answer.
+    async def _apipeline(d: dict):
+        inputs = _prompt_inputs(d, await retriever.ainvoke(_query_variants(d)))
+        if not inputs["context"].strip():
+            yield AddableDict(answer=SCOPE_MSG)
+            return
+        async for delta in llm_chain.astream(inputs):
+            yield AddableDict(answer=delta)
 
-    return chain
+    return RunnableLambda(_pipeline, afunc=_apipeline, name="rag_pipeline")
@@ -1,42 +1,319 @@
 
+import os
+import re
+import math
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generic, List, Optional, TypeVar, Union
+
+from cachetools import LRUCache
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from functools import lru_cache
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import PGVector
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableLambda
+from psycopg_pool import ConnectionPool
+
+from ..services.embeddings import make_embeddings
 
 # ---- New: tighten retrieval so unrelated queries get filtered out
 # Tune between 0.25–0.45 depending on your corpus size/quality
 SCORE_THRESHOLD = 0.35
 
+# Query embeddings kept in memory (384 floats each, so ~1.5 KB per entry)
+QUERY_CACHE_SIZE = 4096
+
+# Reciprocal Rank Fusion damping constant (the usual 60 from the RRF paper)
+RRF_K = 60
+
+# Top-k search over the halfvec HNSW index (created by ingest_pgvector). The
+# score threshold is pushed into SQL so low-relevance rows never leave Postgres.
+# Query vectors stay fp32 in Python and are cast to halfvec server-side.
+# Stored and query vectors are unit length, so inner product == cosine and the
+# index can use <#> (negative inner product) without per-candidate norms.
+_SEARCH_SQL = """
+SELECT document, cmetadata, -(embedding <#> %(q)s::halfvec) AS score
+FROM langchain_pg_embedding
+WHERE collection_id = %(cid)s
+  AND (embedding <#> %(q)s::halfvec) <= -%(threshold)s
+ORDER BY embedding <#> %(q)s::halfvec
+LIMIT %(k)s
+"""
+
+# Keyword side of hybrid search: full-text match on the generated content_tsv
+# column (GIN-indexed by ingest_pgvector). Catches exact names/terms that
+# dense vectors tend to blur.
+_KEYWORD_SQL = """
+SELECT document, cmetadata, ts_rank_cd(content_tsv, query) AS score
+FROM langchain_pg_embedding, plainto_tsquery('english', %(q)s) AS query
+WHERE collection_id = %(cid)s
+  AND content_tsv @@ query
+ORDER BY score DESC
+LIMIT %(k)s
+"""
+
 class Settings(BaseSettings):
     PG_DSN: str
     COLLECTION: str = "business_docs"
     EMB_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    PG_POOL_SIZE: int = 10
+    EMB_WORKERS: int = os.cpu_count() or 1   # threads running query embeddings
 
     # ✅ load .env and ignore unrelated keys (e.g., GOOGLE_API_KEY, GEMINI_MODEL)
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
-@lru_cache
-def _emb():
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model and memoizes embed_query() so repeated
+    questions (UI retries, demos, probes) skip the transformer forward pass.
+    Keys are the whitespace-stripped text, which is also what gets embedded;
+    case is kept so cased models (EMB_MODEL is configurable) see the same
+    text ingest did.
+    """
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        maxsize: int = QUERY_CACHE_SIZE,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.inner = inner
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._executor = executor
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries; cache misses go through one batched forward pass."""
+        keys = [t.strip() for t in texts]
+        with self._lock:
+            vecs = [self._cache.get(k) for k in keys]
+        missing = list(dict.fromkeys(k for k, v in zip(keys, vecs) if v is None))
+        if missing:
+            fresh = dict(zip(missing, self.inner.embed_documents(missing)))
+            with self._lock:
+                self._cache.update(fresh)
+            vecs = [fresh[k] if v is None else v for k, v in zip(keys, vecs)]
+        return [list(v) for v in vecs]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    # The forward pass is CPU-bound; run it off the event loop. torch/ONNX
+    # release the GIL inside their kernels, so the pool gives real parallelism.
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_queries, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_queries([text]))[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_documents, texts)
+
+
+T = TypeVar("T")
+
+
+class _Once(Generic[T]):
+    """
+    Zero-arg memoizer for process-wide singletons. Unlike lru_cache, concurrent
+    first calls (background warmup vs. an early request) build only once.
+    Failures are not cached, so the next call retries.
+    """
+
+    def __init__(self, build: Callable[[], T]):
+        self._build = build
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not None
+
+    def __call__(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._build()
+        return self._value
+
+
+def _limit_torch_threads(workers: int) -> None:
+    """Split cores between embedding workers so N workers x N torch threads don't oversubscribe."""
+    try:
+        import torch
+    except ImportError:  # pragma: no cover - fastembed backend without torch
+        return
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+@_Once
+def _emb() -> CachedQueryEmbeddings:
     st = Settings()
-    return HuggingFaceEmbeddings(model_name=st.EMB_MODEL)
+    workers = max(1, st.EMB_WORKERS)
+    _limit_torch_threads(workers)
+    return CachedQueryEmbeddings(
+        make_embeddings(st.EMB_MODEL),
+        executor=ThreadPoolExecutor(max_workers=workers, thread_name_prefix="emb"),
+    )
+
+
+def _pg_dsn(dsn: str) -> str:
+    """psycopg wants plain 'postgresql://'; PG_DSN carries a SQLAlchemy driver suffix."""
+    return re.sub(r"^postgresql\+\w+://", "postgresql://", dsn)
+
 
-@lru_cache
-def _store():
+@_Once
+def _pool() -> ConnectionPool:
     st = Settings()
-    return PGVector(
-        collection_name=st.COLLECTION,
-        connection_string=st.PG_DSN,
-        embedding_function=_emb(),
+    return ConnectionPool(
+        _pg_dsn(st.PG_DSN),
+        min_size=1,
+        max_size=st.PG_POOL_SIZE,
+        kwargs={"autocommit": True},
+        open=True,
     )
 
+
+@_Once
+def _collection_id() -> str:
+    st = Settings()
+    with _pool().connection() as conn:
+        row = conn.execute(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = %s",
+            (st.COLLECTION,),
+        ).fetchone()
+    if row is None:
+        raise RuntimeError(
+            f"Collection '{st.COLLECTION}' not found; run backend.services.ingest_pgvector first."
+        )
+    return str(row[0])
+
+
+def _vec_literal(vec: List[float]) -> str:
+    return "[" + ",".join(map(str, vec)) + "]"
+
+
+def _l2_normalize(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+def embed_batch(queries: List[str]) -> List[List[float]]:
+    """Embed all query variants of a turn in a single MiniLM forward pass."""
+    return [_l2_normalize(v) for v in _emb().embed_queries(queries)]
+
+
+def _run_search(sql: str, params: dict) -> List[Document]:
+    with _pool().connection() as conn:
+        # prepare=True: server-side prepared statement, reused per connection
+        rows = conn.execute(sql, params, prepare=True).fetchall()
+    return [Document(page_content=doc or "", metadata=meta or {}) for doc, meta, _ in rows]
+
+
+def _dense_search(vec: List[float], k: int) -> List[Document]:
+    params = {
+        "q": _vec_literal(vec),
+        "cid": _collection_id(),
+        "threshold": SCORE_THRESHOLD,
+        "k": k,
+    }
+    return _run_search(_SEARCH_SQL, params)
+
+
+def _keyword_search(query: str, k: int) -> List[Document]:
+    return _run_search(_KEYWORD_SQL, {"q": query, "cid": _collection_id(), "k": k})
+
+
+# Bounds concurrent blocking SQL calls from the async path to the pool size, so
+# surplus calls wait on the event loop instead of parking threads on the pool
+# (where they could hit its checkout timeout).
+_pg_slots: Optional[asyncio.Semaphore] = None
+
+
+async def _pg_call(fn: Callable[..., T], *args) -> T:
+    global _pg_slots
+    if _pg_slots is None:
+        _pg_slots = asyncio.Semaphore(Settings().PG_POOL_SIZE)
+    async with _pg_slots:
+        return await asyncio.to_thread(fn, *args)
+
+
+def _rrf_merge(ranked: List[List[Document]], k: int) -> List[Document]:
+    """Reciprocal Rank Fusion: score(doc) = sum over lists of 1 / (RRF_K + rank)."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for hits in ranked:
+        for rank, d in enumerate(hits, 1):
+            key = d.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            docs.setdefault(key, d)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+    return [docs[key] for key in best]
+
+
+def _clean_queries(queries: Union[str, List[str]]) -> List[str]:
+    if isinstance(queries, str):
+        queries = [queries]
+    return list(dict.fromkeys(q for q in queries if q and q.strip()))
+
+
+def _fuse(dense: List[List[Document]], keyword: List[Document], k: int) -> List[Document]:
+    """
+    RRF-merge all hit lists, but only if the raw question (dense[0] plus the
+    keyword hits) found something in scope. Later variants carry earlier turns'
+    text, so they may clear the threshold for an off-topic follow-up; they are
+    only allowed to add recall, never to make a question in-scope.
+    """
+    if not dense[0] and not keyword:
+        return []
+    return _rrf_merge([*dense, keyword], k)
+
+
+def retrieve(queries: Union[str, List[str]], k: int = 4) -> List[Document]:
+    """
+    Hybrid search for one query or several variants of the same question
+    (the raw question first). Variants are embedded together and searched
+    separately over the vector index; the raw question also runs a full-text
+    search. All hit lists are RRF-merged.
+    """
+    queries = _clean_queries(queries)
+    if not queries:
+        return []
+    vecs = embed_batch(queries)
+    dense = [_dense_search(v, k) for v in vecs]
+    return _fuse(dense, _keyword_search(queries[0], k), k)
+
+
+async def aretrieve(queries: Union[str, List[str]], k: int = 4) -> List[Document]:
+    """Async retrieve(): dense and keyword searches run concurrently."""
+    queries = _clean_queries(queries)
+    if not queries:
+        return []
+    # First call loads the model; never do that on the event loop
+    emb = _emb() if _emb.ready else await asyncio.to_thread(_emb)
+    vecs = [_l2_normalize(v) for v in await emb.aembed_queries(queries)]
+    *dense, keyword = await asyncio.gather(
+        *(_pg_call(_dense_search, v, k) for v in vecs),
+        _pg_call(_keyword_search, queries[0], k),
+    )
+    return _fuse(dense, keyword, k)
+
+
 def get_retriever(k: int = 4):
-    # return _store().as_retriever(search_kwargs={"k": k})
-     """
-     Retriever that *drops* low-relevance hits via similarity score threshold.
-     If nothing clears the bar, we treat the query as out-of-scope.
-     """
-     return _store().as_retriever(
-         search_type="similarity_score_threshold",
-         search_kwargs={"k": k, "score_threshold": SCORE_THRESHOLD},
-         )
+    """
+    Hybrid retriever: dense hits below SCORE_THRESHOLD are dropped, while
+    full-text hits (an exact term match) are kept regardless of score.
+    If the raw question gets neither, it returns [] and we treat the query as
+    out-of-scope. Accepts a question string or a list of query variants
+    (raw question first).
+    """
+
+    async def _aretrieve(queries):
+        return await aretrieve(queries, k)
+
+    return RunnableLambda(lambda queries: retrieve(queries, k), afunc=_aretrieve)
@@ -12,6 +12,7 @@ class Settings(BaseSettings):
     model_config = {"env_file": ".env", "extra": "ignore"}
 
 
+# One client per process so its pooled keep-alive connections are reused
 @lru_cache
 def get_llm():
     s = Settings()
@@ -1,5 +1,6 @@
 
 from __future__ import annotations
+from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from langchain_google_genai import ChatGoogleGenerativeAI
 
@@ -11,6 +12,9 @@ class Settings(BaseSettings):
     # 👇 pydantic v2 style: load .env and ignore unrelated keys like PG_DSN
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
+# One client per process: its gRPC channel (and TLS session) is reused
+# across requests instead of being re-established for every chat turn.
+@lru_cache
 def get_llm():
     s = Settings()
     return ChatGoogleGenerativeAI(
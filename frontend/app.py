@@ -1,13 +1,16 @@
 # app.py
 import os
+import json
 import uuid
 import time
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------- Config ----------
 DEFAULT_API = os.getenv("RAG_API_BASE", "http://127.0.0.1:8000")
-CHAT_EP = "/api/chat"
+CHAT_STREAM_EP = "/api/chat_stream"   # SSE: tokens rendered as they arrive
 DEBUG_EP = "/api/chat_debug"   # optional: to peek retrieval chunks
 
 # Exact refusal text coming from backend (chains.py SCOPE_MSG)
@@ -66,14 +69,50 @@ for role, content in st.session_state.messages:
             st.markdown(content)
 
 # ---------- Helpers ----------
+@st.cache_resource
+def http_session() -> requests.Session:
+    """One keep-alive session per Streamlit server (reruns re-execute this script)."""
+    s = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=4,
+        max_retries=Retry(total=2, backoff_factor=0.3),
+    )
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers.update({"Connection": "keep-alive"})
+    return s
+
 def post_json(url: str, payload: dict, timeout=240):
     try:
-        r = requests.post(url, json=payload, timeout=timeout)
+        r = http_session().post(url, json=payload, timeout=timeout)
         r.raise_for_status()
         return r.json(), None
     except requests.exceptions.RequestException as e:
         return None, str(e)
 
+def open_stream(url: str, payload: dict, timeout=240):
+    """POST and return the open streaming response (or an error string)."""
+    try:
+        r = http_session().post(url, json=payload, timeout=timeout, stream=True)
+        r.raise_for_status()
+        return r, None
+    except requests.exceptions.RequestException as e:
+        return None, str(e)
+
+def iter_sse_deltas(resp):
+    """Yield text deltas from the backend's `data: {...}` SSE lines."""
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        if event.get("error"):
+            raise RuntimeError(event["error"])
+        yield event.get("delta", "")
+
 # ---------- Input ----------
 prompt = st.chat_input("Ask something…")
 if prompt:
@@ -82,7 +121,7 @@ if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # call main /api/chat
+    # call /api/chat_stream (tokens rendered as they arrive)
     with st.chat_message("assistant"):
         placeholder = st.empty()
         placeholder.markdown("_thinking…_")
@@ -93,21 +132,25 @@ if prompt:
             "session_id": st.session_state.session_id,
             "provider": provider,  # <-- send chosen LLM provider to backend
         }
-        resp, err = post_json(api_base + CHAT_EP, data)
+        resp, err = open_stream(api_base + CHAT_STREAM_EP, data)
+        answer = None
+        if not err:
+            try:
+                with resp, placeholder.container():
+                    answer = st.write_stream(iter_sse_deltas(resp))
+            except (requests.exceptions.RequestException, RuntimeError) as e:
+                err = str(e)
 
         if err:
             placeholder.error(f"Request failed: {err}")
         else:
-            answer = resp.get("answer") if isinstance(resp, dict) else resp
-            if isinstance(answer, dict):
+            if not isinstance(answer, str):
                 answer = str(answer)
 
             # Render refusal verbatim as a highlighted callout
-            if isinstance(answer, str) and answer.strip().startswith(REFUSAL_TEXT):
+            if answer.strip().startswith(REFUSAL_TEXT):
                 placeholder.empty()
                 st.warning(f"**Out of scope**\n\n{answer}")
-            else:
-                placeholder.markdown(answer)
 
             # store assistant message back into session history
             st.session_state.messages.append(("assistant", answer))